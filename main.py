@@ -1,23 +1,33 @@
 # main.py
 from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-import fitz  # PyMuPDF
-from pptx import Presentation
-from docx import Document
-import openai
-import os
-import sympy as sp
-from sympy.parsing.sympy_parser import parse_expr
-from typing import Dict, List
-import json
-import io
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from pydantic import BaseModel
+import orjson
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional
 import logging
 
+from services.batch import batch_queue
+from services.cache import cache_lookup, cache_store, cached_exam_questions
+from services.extraction import (
+    UploadSizeLimitMiddleware, extract_text, start_extraction_pools, start_unoserver,
+    stop_extraction_pools, stop_unoserver, upload_source, validate_extension, wait_for_unoserver
+)
+from services.llm import close_client, get_client
+from services.math_solver import solve_math_problem
+from services.questions import QUESTION_COUNTS, flatten_questions, stream_exam_questions
+from services.storage import close_storage, load_answers, load_questions, save_answers, save_questions
+
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+# Oversized bodies are rejected before form parsing; added first so CORS wraps it
+app.add_middleware(UploadSizeLimitMiddleware)
 
 # CORS Configuration
 app.add_middleware(
@@ -28,145 +38,107 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize OpenAI
-openai.api_key = os.getenv("OPENAI_API_KEY")
+# ====================== REQUEST MODELS ======================
+class Submission(BaseModel):
+    """One student's answers, keyed by question text"""
+    student: Optional[str] = None
+    answers: Dict[str, str]
 
-# In-memory storage with file validation
-question_bank: Dict[str, Dict] = {}
-student_answers: Dict[str, Dict] = {}
-SUPPORTED_EXTENSIONS = {"pdf", "docx", "pptx", "ppt"}
+class GradeBatchRequest(BaseModel):
+    """Answers from many students for the same uploaded file"""
+    filename: str
+    answers: List[Submission]
 
-# ====================== HELPER FUNCTIONS ======================
-def extract_text(file_bytes: bytes, extension: str) -> str:
-    """Extract text from supported file formats with error handling"""
-    try:
-        logger.info(f"Processing {extension.upper()} file")
-        
-        if extension == "pdf":
-            with fitz.open(stream=file_bytes, filetype="pdf") as doc:
-                return " ".join([page.get_text() for page in doc])
-        
-        elif extension in {"pptx", "ppt"}:
-            prs = Presentation(io.BytesIO(file_bytes))
-            return " ".join([
-                shape.text 
-                for slide in prs.slides 
-                for shape in slide.shapes 
-                if hasattr(shape, "text")
-            ])
-        
-        elif extension == "docx":
-            doc = Document(io.BytesIO(file_bytes))
-            return " ".join([para.text for para in doc.paragraphs])
-        
-        raise ValueError(f"Unsupported file type: {extension}")
-    
-    except Exception as e:
-        logger.error(f"Text extraction failed: {str(e)}")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Failed to process {extension.upper()} file: {str(e)}"
-        )
+# ====================== GRADING ======================
+def grade_answers(flat: List, answers: Dict) -> List[bool]:
+    """Mark each stored (question, normalized answer) pair correct or not for one student"""
+    return [
+        str(answers.get(question, "")).strip().lower() == correct_answer
+        for question, correct_answer in flat
+    ]
 
-def solve_math_problem(problem: str) -> Dict:
-    """Solve mathematical equations with SymPy"""
-    try:
-        # Handle different equation formats
-        problem = problem.replace("^", "**").strip()
-        expr = parse_expr(problem)
-        solution = sp.solve(expr)
-        steps = sp.pretty(solution)
-        return {
-            "problem": problem,
-            "solution": str(solution),
-            "steps": steps
-        }
-    except Exception as e:
-        logger.error(f"Math solving failed: {str(e)}")
-        return {
-            "error": f"Could not solve {problem}",
-            "details": str(e)
-        }
+# ====================== API ENDPOINTS ======================
+@app.on_event("startup")
+async def start_batch_queue():
+    """Start the periodic Batch API flush"""
+    app.state.batch_task = asyncio.create_task(batch_queue.run())
 
-def generate_exam_questions(text: str) -> Dict:
-    """Generate 50 questions using OpenAI with validation"""
-    try:
-        prompt = f"""Generate 50 comprehensive exam questions from this text.
-        Include multiple choice, fill-in-the-blank, and short answer questions.
-        Use this exact JSON format:
-        {{
-            "multiple_choice": [
-                {{"question": "...", "options": ["A","B","C","D"], "answer": "A"}}
-            ],
-            "fill_in": [
-                {{"question": "...", "answer": "..."}}
-            ],
-            "short_answer": [
-                {{"question": "...", "answer": "..."}}
-            ]
-        }}
-        Text content: {text[:3000]}"""  # Limit text length for OpenAI
-
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[{
-                "role": "user",
-                "content": prompt
-            }],
-            temperature=0.3  # More deterministic output
-        )
-        
-        # Validate and parse response
-        content = response.choices[0].message.content
-        try:
-            return json.loads(content)
-        except json.JSONDecodeError:
-            logger.error("Invalid JSON from OpenAI: %s", content)
-            raise HTTPException(
-                status_code=500,
-                detail="Failed to parse question format. Please try again."
-            )
-    
-    except openai.error.AuthenticationError:
-        raise HTTPException(
-            status_code=401,
-            detail="Invalid OpenAI API key. Check your configuration."
-        )
-    except Exception as e:
-        logger.error(f"OpenAI API Error: {str(e)}")
-        raise HTTPException(
-            status_code=500,
-            detail=f"Question generation failed: {str(e)}"
-        )
+@app.on_event("startup")
+async def start_extraction():
+    """Start the PDF extraction worker processes"""
+    start_extraction_pools()
+
+@app.on_event("startup")
+async def start_converter():
+    """Start the .ppt conversion daemon without delaying startup"""
+    start_unoserver()
+    app.state.unoserver_task = asyncio.create_task(wait_for_unoserver())
+
+@app.on_event("shutdown")
+async def stop_converter():
+    """Stop the .ppt conversion daemon"""
+    stop_unoserver()
+
+@app.on_event("shutdown")
+async def stop_extraction():
+    """Stop the extraction worker pools"""
+    stop_extraction_pools()
+
+@app.on_event("shutdown")
+async def stop_storage():
+    """Close the Redis connection pool"""
+    await close_storage()
+
+@app.on_event("shutdown")
+async def stop_openai_client():
+    """Close the OpenAI connection pool"""
+    await close_client()
 
-# ====================== API ENDPOINTS ======================
 @app.get("/")
 async def welcome():
     """Display welcome message with emoji"""
     return {"message": "Hello student 😊, welcome to Sir John's learning tool. Enjoy!"}
 
 @app.post("/upload/")
-async def upload_file(file: UploadFile = File(...)):
-    """Process uploaded files and generate questions"""
+@app.post("/upload-slide/")
+async def upload_file(file: UploadFile = File(...), priority: str = "high"):
+    """Process uploaded files and generate questions
+
+    priority=low queues generation for the OpenAI Batch API; poll
+    /upload/{filename}/status for the questions.
+    """
     try:
         # Validate file type
-        extension = file.filename.split(".")[-1].lower()
-        if extension not in SUPPORTED_EXTENSIONS:
+        extension = validate_extension(file.filename)
+        if priority not in {"high", "low"}:
             raise HTTPException(
                 status_code=400,
-                detail=f"Unsupported file type. Supported formats: {SUPPORTED_EXTENSIONS}"
+                detail="Invalid priority. Use 'high' or 'low'."
             )
         
         # Process file
-        file_bytes = await file.read()
-        text = extract_text(file_bytes, extension)
-        questions = generate_exam_questions(text)
+        async with upload_source(file, extension) as source:
+            text = await run_in_threadpool(extract_text, source, extension)
+
+        if priority == "low":
+            questions, embeddings = await cache_lookup(text)
+            if questions is None:
+                await save_questions(file.filename, {"text": text, "batch_id": None})
+                await batch_queue.enqueue(file.filename, text, embeddings)
+                return {
+                    "filename": file.filename,
+                    "status": "queued",
+                    "message": "File queued for question generation"
+                }
+        else:
+            questions = await cached_exam_questions(text)
         
         # Store results
-        question_bank[file.filename] = {
+        await save_questions(file.filename, {
             "text": text,
-            "questions": questions
-        }
+            "questions": questions,
+            "flat": flatten_questions(questions)
+        })
         
         return {
             "filename": file.filename,
@@ -183,10 +155,104 @@ async def upload_file(file: UploadFile = File(...)):
             detail=f"Internal server error: {str(e)}"
         )
 
+@app.post("/generate-questions/")
+async def generate_questions(text: str = Form(...)):
+    """Generate questions from raw text without uploading a file"""
+    if not text.strip():
+        raise HTTPException(status_code=400, detail="Text is empty")
+    return {"questions": await cached_exam_questions(text)}
+
+@app.post("/upload-stream/")
+async def upload_file_stream(file: UploadFile = File(...)):
+    """Process an uploaded file and stream its questions as NDJSON while they are generated"""
+    try:
+        extension = validate_extension(file.filename)
+        async with upload_source(file, extension) as source:
+            text = await run_in_threadpool(extract_text, source, extension)
+        cached, embeddings = await cache_lookup(text)
+    except HTTPException as he:
+        raise he
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Internal server error: {str(e)}"
+        )
+
+    async def question_lines() -> AsyncIterator[bytes]:
+        if cached is not None:
+            questions = cached
+            for q_type in QUESTION_COUNTS:
+                for question in cached.get(q_type, []):
+                    yield orjson.dumps({"type": q_type, **question}) + b"\n"
+        else:
+            questions = {q_type: [] for q_type in QUESTION_COUNTS}
+            try:
+                async for question in stream_exam_questions(text):
+                    yield orjson.dumps(question) + b"\n"
+                    q_type = question.pop("type")
+                    questions[q_type].append(question)
+            except Exception as e:
+                # Headers are already sent, so report the failure in-band
+                logger.error(f"Question streaming failed: {str(e)}")
+                yield orjson.dumps({"type": "error", "detail": "Question generation failed. Please try again."}) + b"\n"
+                return
+            cache_store(embeddings, questions)
+
+        await save_questions(file.filename, {
+            "text": text,
+            "questions": questions,
+            "flat": flatten_questions(questions)
+        })
+
+    return StreamingResponse(question_lines(), media_type="application/x-ndjson")
+
+@app.get("/upload/{filename}/status")
+async def upload_status(filename: str):
+    """Report progress of a low-priority upload, returning its questions once ready"""
+    entry = await load_questions(filename)
+    if not entry:
+        raise HTTPException(status_code=404, detail="File not found")
+
+    if "questions" not in entry and "error" not in entry and entry.get("batch_id"):
+        try:
+            batch = await get_client().batches.retrieve(entry["batch_id"])
+            if batch.status == "completed":
+                await batch_queue.collect(batch.id, batch.output_file_id, batch.error_file_id)
+                entry = await load_questions(filename)
+                if "questions" not in entry and "error" not in entry:
+                    # The completed batch had no result for this file
+                    entry["error"] = "Question generation failed. Please upload again."
+                    await save_questions(filename, entry)
+            elif batch.status in {"failed", "expired", "cancelled"}:
+                batch_queue.discard(filename)
+                entry["error"] = f"Batch {batch.status}. Please upload again."
+                await save_questions(filename, entry)
+            else:
+                return {"filename": filename, "status": batch.status}
+        except HTTPException:
+            raise
+        except Exception as e:
+            logger.error(f"Batch status check failed: {str(e)}")
+            raise HTTPException(
+                status_code=502,
+                detail=f"Failed to check batch status: {str(e)}"
+            )
+
+    if "error" in entry:
+        return {"filename": filename, "status": "failed", "message": entry["error"]}
+    if "questions" not in entry:
+        return {"filename": filename, "status": "queued"}
+    return {
+        "filename": filename,
+        "status": "completed",
+        "questions": entry["questions"]
+    }
+
 @app.post("/solve-math/")
 async def math_solver(problem: str = Form(...)):
     """Solve mathematical equations"""
-    result = solve_math_problem(problem)
+    result = await run_in_threadpool(solve_math_problem, problem)
     if "error" in result:
         raise HTTPException(
             status_code=400,
@@ -200,15 +266,15 @@ async def submit_answers(filename: str = Form(...), answers: str = Form(...)):
     try:
         # Validate answers format
         try:
-            answers_dict = json.loads(answers)
-        except json.JSONDecodeError:
+            answers_dict = orjson.loads(answers)
+        except orjson.JSONDecodeError:
             raise HTTPException(
                 status_code=400,
                 detail="Invalid answer format. Use JSON."
             )
         
         # Store answers
-        student_answers[filename] = answers_dict
+        await save_answers(filename, answers_dict)
         return {"message": "Answers submitted successfully"}
     
     except Exception as e:
@@ -222,29 +288,23 @@ async def submit_answers(filename: str = Form(...), answers: str = Form(...)):
 async def get_results(filename: str):
     """Provide graded results and study suggestions"""
     try:
-        # Get stored data
-        questions = question_bank.get(filename, {})
-        answers = student_answers.get(filename, {})
+        # Get stored data; answers were normalized when the questions were stored
+        flat = (await load_questions(filename)).get("flat", [])
+        answers = await load_answers(filename)
         
         # Calculate score
-        correct = 0
-        total = 0
+        matches = grade_answers(flat, answers)
+        correct = sum(matches)
+        total = len(flat)
         feedback = []
         
-        for q_type in ["multiple_choice", "fill_in", "short_answer"]:
-            for question in questions.get("questions", {}).get(q_type, []):
-                total += 1
-                user_answer = answers.get(question["question"], "").strip().lower()
-                correct_answer = question["answer"].strip().lower()
-                
-                if user_answer == correct_answer:
-                    correct += 1
-                else:
-                    feedback.append({
-                        "question": question["question"],
-                        "your_answer": user_answer,
-                        "correct_answer": correct_answer
-                    })
+        for (question, correct_answer), match in zip(flat, matches):
+            if not match and len(feedback) < 5:
+                feedback.append({
+                    "question": question,
+                    "your_answer": str(answers.get(question, "")).strip().lower(),
+                    "correct_answer": correct_answer
+                })
         
         # Generate suggestions
         score = (correct / total) * 100 if total > 0 else 0
@@ -273,7 +333,7 @@ async def get_results(filename: str):
             "score": f"{score:.1f}%",
             "correct": correct,
             "total": total,
-            "feedback": feedback[:5],  # Show top 5 mistakes
+            "feedback": feedback,  # Top 5 mistakes
             "suggestions": suggestions
         }
     
@@ -283,3 +343,39 @@ async def get_results(filename: str):
             status_code=500,
             detail=f"Failed to generate results: {str(e)}"
         )
+
+@app.post("/grade-batch/")
+async def grade_batch(request: GradeBatchRequest):
+    """Grade many students' answers for one file"""
+    flat = (await load_questions(request.filename)).get("flat")
+    if not flat:
+        raise HTTPException(status_code=404, detail="No questions found for this file")
+
+    try:
+        total = len(flat)
+        results = []
+        for submission in request.answers:
+            matches = grade_answers(flat, submission.answers)
+            correct = sum(matches)
+            results.append({
+                "student": submission.student,
+                "correct": correct,
+                "score": f"{correct / total * 100:.1f}%",
+                "per_question": matches
+            })
+        average = sum(result["correct"] for result in results) / len(results) / total * 100 if results else 0
+
+        return {
+            "filename": request.filename,
+            "questions": [question for question, _ in flat],
+            "total": total,
+            "average_score": f"{average:.1f}%",
+            "results": results
+        }
+
+    except Exception as e:
+        logger.error(f"Batch grading failed: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to grade answers: {str(e)}"
+        )
@@ -0,0 +1 @@
+"""Extraction, question generation, caching and storage behind the API endpoints"""
@@ -0,0 +1,140 @@
+# services/batch.py
+import orjson
+import numpy as np
+import asyncio
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import logging
+
+from services.cache import cache_store
+from services.llm import get_client
+from services.questions import (
+    PROMPT_CHAR_LIMIT, build_question_request, flatten_questions, parse_questions, require_complete
+)
+from services.storage import (
+    has_pending_request, load_batch_files, load_questions, restore_pending_requests,
+    save_batch_files, save_pending_request, save_questions, take_pending_requests
+)
+
+logger = logging.getLogger(__name__)
+
+# Low-priority uploads are queued for the OpenAI Batch API (half price, 24h window)
+BATCH_FLUSH_SECONDS = 60
+BATCH_EMBEDDINGS_MAX = 1024  # bounds cache keys kept for batches this worker may never collect
+
+class BatchQueueManager:
+    """Collect low-priority generation requests and submit them through the OpenAI Batch API
+
+    Pending request lines live in Redis, so they survive restarts and any worker's
+    flush submits them. Cache embeddings stay in the enqueuing worker, bounded.
+    """
+
+    def __init__(self, flush_seconds: int):
+        self.flush_seconds = flush_seconds
+        self.embeddings: "OrderedDict[str, Optional[np.ndarray]]" = OrderedDict()  # filename -> cache keys
+
+    async def enqueue(self, filename: str, text: str, embeddings: Optional[np.ndarray]) -> None:
+        """Queue a generation request; a re-upload replaces the earlier pending one"""
+        await save_pending_request(filename, {
+            "custom_id": filename,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": build_question_request(text)
+        })
+        if len(text) > PROMPT_CHAR_LIMIT:
+            # The batch prompt reads only the opening of the text, while the cache keys
+            # cover the whole summarized span; don't index questions under text they skip
+            embeddings = None
+        self.embeddings[filename] = embeddings
+        self.embeddings.move_to_end(filename)
+        if len(self.embeddings) > BATCH_EMBEDDINGS_MAX:
+            self.embeddings.popitem(last=False)
+
+    def discard(self, filename: str) -> None:
+        """Drop the cache keys of a file whose batch request has finished"""
+        self.embeddings.pop(filename, None)
+
+    async def submit(self, lines: List[Dict]) -> str:
+        """Upload the JSONL request file and start a batch, returning its id"""
+        jsonl = b"\n".join([orjson.dumps(line) for line in lines])
+        batch_file = await get_client().files.create(file=("questions.jsonl", jsonl), purpose="batch")
+        batch = await get_client().batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        return batch.id
+
+    async def flush(self) -> None:
+        """Submit everything queued since the last flush"""
+        lines = await take_pending_requests()
+        if not lines:
+            return
+        try:
+            batch_id = await self.submit(list(lines.values()))
+        except Exception as e:
+            logger.error(f"Batch submission failed: {str(e)}")
+            # Requeue unless a newer upload of the same file arrived meanwhile
+            await restore_pending_requests(lines)
+            return
+        logger.info(f"Submitted batch {batch_id} with {len(lines)} requests")
+        await save_batch_files(batch_id, list(lines))
+        for filename in lines:
+            if await has_pending_request(filename):
+                continue  # Re-uploaded while this batch was being submitted
+            entry = await load_questions(filename)
+            if entry:
+                entry["batch_id"] = batch_id
+                await save_questions(filename, entry)
+
+    async def run(self) -> None:
+        """Flush the queue every flush_seconds for the lifetime of the app"""
+        while True:
+            await asyncio.sleep(self.flush_seconds)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Batch flush failed: {str(e)}")
+
+    async def collect(self, batch_id: str, output_file_id: Optional[str], error_file_id: Optional[str]) -> None:
+        """Store the questions from a completed batch, marking every file it did not answer as failed
+
+        Successful requests are written to the output file and failed ones to the
+        error file; either may be missing.
+        """
+        lines = []
+        for file_id in (output_file_id, error_file_id):
+            if file_id:
+                lines += (await get_client().files.content(file_id)).content.splitlines()
+        for line in lines:
+            if not line.strip():
+                continue
+            result = orjson.loads(line)  # orjson parses the raw bytes without decoding first
+            filename = result["custom_id"]
+            entry = await load_questions(filename)
+            if entry.get("batch_id") != batch_id or "questions" in entry or "error" in entry:
+                continue  # Re-uploaded since submission, or already collected
+            embeddings = self.embeddings.pop(filename, None)
+            try:
+                if result.get("error"):
+                    raise ValueError(result["error"].get("message", "request failed"))
+                if result["response"]["status_code"] != 200:
+                    raise ValueError(f"request returned {result['response']['status_code']}")
+                content = result["response"]["body"]["choices"][0]["message"]["content"]
+                entry["questions"] = require_complete(parse_questions(content))
+                entry["flat"] = flatten_questions(entry["questions"])
+                cache_store(embeddings, entry["questions"])
+            except Exception as e:
+                logger.error(f"Batch result for {filename} unusable: {str(e)}")
+                entry["error"] = "Question generation failed. Please upload again."
+            await save_questions(filename, entry)
+
+        # Files that appear in neither file, e.g. when the batch produced no output at all
+        for filename in await load_batch_files(batch_id):
+            entry = await load_questions(filename)
+            if entry.get("batch_id") == batch_id and "questions" not in entry and "error" not in entry:
+                self.discard(filename)
+                entry["error"] = "Question generation failed. Please upload again."
+                await save_questions(filename, entry)
+
+batch_queue = BatchQueueManager(BATCH_FLUSH_SECONDS)
@@ -0,0 +1,172 @@
+# services/cache.py
+import numpy as np
+import random
+from typing import Dict, List, Optional, Tuple
+import logging
+
+from services.llm import get_client
+from services.questions import (
+    GENERATION_SOURCE_CHARS, QUESTION_COUNTS, generate_exam_questions, questions_complete
+)
+
+logger = logging.getLogger(__name__)
+
+# Semantic cache settings
+EMBEDDING_MODEL = "text-embedding-3-small"
+CACHE_SIMILARITY_THRESHOLD = 0.92
+CACHE_MAX_ENTRIES = 1024
+
+# Generative cache settings: compose answers from cached chunks of other decks
+CHUNK_WORDS = 375  # roughly 500 tokens
+CHUNK_SIMILARITY_THRESHOLD = 0.8  # t_single
+COMBINED_SIMILARITY_THRESHOLD = 1.5  # t_combined
+# Cached questions cover whole decks, so composition needs both directions: every
+# chunk of the new text must match, and every deck drawn from must be matched
+# almost entirely, or the new text gets questions on material it lacks
+MIN_CHUNK_COVERAGE = 1.0  # share of the new text's chunks that must match
+MIN_SOURCE_COVERAGE = 0.9  # share of a cached deck's chunks that must be matched
+
+class SemanticCache:
+    """Bounded LRU store of generated questions keyed by normalized text embeddings"""
+
+    def __init__(self, threshold: float, maxsize: int):
+        self.threshold = threshold
+        self.maxsize = maxsize
+        self.vectors: Optional[np.ndarray] = None
+        self.payloads: List[Optional[Dict]] = [None] * maxsize
+        self.last_used = np.zeros(maxsize, dtype=np.int64)  # 0 marks an empty slot
+        self.clock = 0
+
+    def lookup(self, embedding: np.ndarray) -> Optional[Tuple[Dict, float]]:
+        """Return the most similar cached payload and its score, if above threshold"""
+        if self.vectors is None:
+            return None
+        scores = self.vectors @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            return None
+        self.clock += 1
+        self.last_used[best] = self.clock
+        return self.payloads[best], float(scores[best])
+
+    def add(self, embedding: np.ndarray, payload: Dict) -> None:
+        """Store a payload, evicting the least recently used entry when full"""
+        if self.vectors is None:
+            self.vectors = np.zeros((self.maxsize, embedding.shape[0]), dtype=np.float32)
+        slot = int(np.argmin(self.last_used))
+        self.clock += 1
+        self.vectors[slot] = embedding
+        self.payloads[slot] = payload
+        self.last_used[slot] = self.clock
+
+question_cache = SemanticCache(CACHE_SIMILARITY_THRESHOLD, CACHE_MAX_ENTRIES)
+chunk_cache = SemanticCache(CHUNK_SIMILARITY_THRESHOLD, CACHE_MAX_ENTRIES)
+
+async def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts with OpenAI and L2-normalize so dot products are cosine similarities"""
+    response = await get_client().embeddings.create(model=EMBEDDING_MODEL, input=texts)
+    vectors = np.array([item.embedding for item in response.data], dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def split_chunks(text: str) -> List[str]:
+    """Split text into word windows of roughly 500 tokens"""
+    words = text.split()
+    return [
+        " ".join(words[i:i + CHUNK_WORDS])
+        for i in range(0, len(words), CHUNK_WORDS)
+    ]
+
+def compose_questions(matches: List[Tuple[Dict, float]]) -> Dict:
+    """Assemble a question set from cached decks, weighted by chunk similarity
+
+    Each match is a chunk-cache entry ({"questions", "chunk", "chunks"}) and its score.
+    """
+    sources: Dict[int, Dict] = {}
+    weights: Dict[int, float] = {}
+    for chunk, score in matches:
+        questions = chunk["questions"]
+        sources[id(questions)] = questions
+        weights[id(questions)] = weights.get(id(questions), 0.0) + score
+    total_weight = sum(weights.values())
+
+    composed = {}
+    for q_type, count in QUESTION_COUNTS.items():
+        picked = []
+        seen = set()
+        for key, weight in weights.items():
+            pool = [q for q in sources[key].get(q_type, []) if q["question"] not in seen]
+            quota = min(len(pool), round(count * weight / total_weight))
+            for question in random.sample(pool, quota):
+                picked.append(question)
+                seen.add(question["question"])
+        # Top up from any source when rounding or a short pool left gaps
+        for key in weights:
+            for question in sources[key].get(q_type, []):
+                if len(picked) >= count:
+                    break
+                if question["question"] not in seen:
+                    picked.append(question)
+                    seen.add(question["question"])
+        composed[q_type] = picked[:count]
+    return composed
+
+async def cache_lookup(text: str) -> Tuple[Optional[Dict], Optional[np.ndarray]]:
+    """Look up cached questions for the text, returning them (or None) with the
+    embeddings to pass to cache_store once fresh questions are generated"""
+    # Key on the whole span generation reads; a single embedding input cannot hold it,
+    # so the whole-text embedding is the normalized mean of its chunk embeddings
+    chunks = split_chunks(text[:GENERATION_SOURCE_CHARS])
+    if not chunks:
+        return None, None
+    try:
+        chunk_embeddings = await embed_texts(chunks)
+    except Exception as e:
+        # The cache is an optimization; never fail an upload because of it
+        logger.warning(f"Embedding failed, skipping cache: {str(e)}")
+        return None, None
+    embedding = chunk_embeddings.mean(axis=0)
+    embedding /= np.linalg.norm(embedding)
+    embeddings = np.vstack([embedding, chunk_embeddings])
+
+    cached = question_cache.lookup(embedding)
+    if cached is not None:
+        logger.info("Semantic cache hit")
+        return cached[0], None
+
+    # Generative cache: every chunk resembles a chunk of a previously processed deck
+    matches = [m for m in (chunk_cache.lookup(e) for e in chunk_embeddings) if m is not None]
+    # Only decks whose own chunks are nearly all matched may contribute questions
+    matched_chunks: Dict[int, set] = {}
+    for chunk, _ in matches:
+        matched_chunks.setdefault(id(chunk["questions"]), set()).add(chunk["chunk"])
+    matches = [
+        (chunk, score) for chunk, score in matches
+        if len(matched_chunks[id(chunk["questions"])]) >= MIN_SOURCE_COVERAGE * chunk["chunks"]
+    ]
+    combined = sum(score for _, score in matches)
+    if combined > COMBINED_SIMILARITY_THRESHOLD and len(matches) >= MIN_CHUNK_COVERAGE * len(chunks):
+        logger.info(f"Generative cache hit: {len(matches)}/{len(chunks)} chunks, similarity {combined:.2f}")
+        questions = compose_questions(matches)
+        question_cache.add(embedding, questions)
+        return questions, None
+
+    return None, embeddings
+
+def cache_store(embeddings: Optional[np.ndarray], questions: Dict) -> None:
+    """Index freshly generated questions under the whole-text and chunk embeddings;
+    partial sets (e.g. a cut-off stream) are never cached"""
+    if embeddings is None or not questions_complete(questions):
+        return
+    question_cache.add(embeddings[0], questions)
+    chunk_count = len(embeddings) - 1
+    for i, chunk_embedding in enumerate(embeddings[1:]):
+        chunk_cache.add(chunk_embedding, {"questions": questions, "chunk": i, "chunks": chunk_count})
+
+async def cached_exam_questions(text: str) -> Dict:
+    """Serve questions from the semantic or generative cache, generating them on a miss"""
+    questions, embeddings = await cache_lookup(text)
+    if questions is not None:
+        return questions
+    questions = await generate_exam_questions(text)
+    cache_store(embeddings, questions)
+    return questions
@@ -0,0 +1,263 @@
+# services/extraction.py
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import ORJSONResponse
+import fitz  # PyMuPDF
+from pptx import Presentation
+from docx import Document
+import os
+import asyncio
+import contextlib
+import multiprocessing
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import IO, AsyncIterator, Optional, Tuple, Union
+import io
+import logging
+
+try:
+    from unoserver.client import UnoClient
+except ImportError:  # .ppt conversion falls back to the LibreOffice CLI
+    UnoClient = None
+
+logger = logging.getLogger(__name__)
+
+# File validation
+SUPPORTED_EXTENSIONS = {"pdf", "docx", "pptx", "ppt"}
+
+# Request bodies are capped before the multipart form is parsed
+MAX_UPLOAD_BYTES = 100 * 1024 * 1024
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# PDF workers and LibreOffice open files by path; the other formats are read
+# straight from the upload Starlette has already spooled
+PATH_EXTENSIONS = {"pdf", "ppt"}
+
+# PDF extraction is spread across worker processes for larger documents
+PDF_WORKERS = min(os.cpu_count() or 1, 4)
+PDF_PARALLEL_MIN_PAGES = 16
+pdf_pool: Optional[ProcessPoolExecutor] = None
+
+# Large slide decks are walked slide-by-slide in a thread pool
+PPTX_WORKERS = 4
+PPTX_PARALLEL_MIN_SLIDES = 20
+pptx_pool: Optional[ThreadPoolExecutor] = None
+
+# Legacy .ppt decks are converted to .pptx with LibreOffice before extraction. A
+# persistent unoserver daemon avoids paying LibreOffice startup on every upload.
+LIBREOFFICE_TIMEOUT = 120
+UNOSERVER_HOST = "127.0.0.1"
+UNOSERVER_PORT = 2003
+UNOSERVER_STARTUP_SECONDS = 30
+unoserver_process: Optional[subprocess.Popen] = None
+unoserver_ready = False
+unoserver_lock = threading.Lock()  # soffice converts one document at a time
+
+def validate_extension(filename: str) -> str:
+    """Return the lowercase extension of a supported upload, rejecting anything else"""
+    extension = filename.split(".")[-1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type. Supported formats: {SUPPORTED_EXTENSIONS}"
+        )
+    return extension
+
+class UploadSizeLimitMiddleware:
+    """Reject request bodies over max_bytes before FastAPI reads and parses the form
+
+    The declared Content-Length is checked up front; bodies without one are counted
+    as they arrive and cut off once they pass the limit.
+    """
+
+    def __init__(self, app, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.app = app
+        self.max_bytes = max_bytes
+
+    def too_large(self) -> HTTPException:
+        """Build the 413 error for an oversized body"""
+        return HTTPException(
+            status_code=413,
+            detail=f"File too large. Maximum size is {self.max_bytes // (1024 * 1024)} MB."
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_bytes:
+            error = self.too_large()
+            response = ORJSONResponse({"detail": error.detail}, status_code=error.status_code)
+            return await response(scope, receive, send)
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    raise self.too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+@contextlib.asynccontextmanager
+async def upload_source(file: UploadFile, extension: str) -> AsyncIterator[Union[str, IO[bytes]]]:
+    """Yield what extract_text reads for an upload: the spooled file itself, or for
+    formats opened by path, a temp copy made in 1 MB chunks and removed on exit"""
+    if extension not in PATH_EXTENSIONS:
+        await file.seek(0)
+        yield file.file
+        return
+
+    fd, path = tempfile.mkstemp(suffix=f".{extension}")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                out.write(chunk)
+        yield path
+    finally:
+        os.unlink(path)
+
+def extract_pdf_pages(job: Tuple[str, int, int]) -> str:
+    """Extract the joined text of a range of PDF pages (runs in a worker process)"""
+    path, start, stop = job
+    with fitz.open(path) as doc:
+        return " ".join([doc[i].get_text() for i in range(start, stop)])
+
+def start_extraction_pools() -> None:
+    """Create the extraction pools; forkserver PDF workers do not inherit the server's threads"""
+    global pdf_pool, pptx_pool
+    pptx_pool = ThreadPoolExecutor(max_workers=PPTX_WORKERS)
+    if PDF_WORKERS < 2:
+        return
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context(method))
+
+def stop_extraction_pools() -> None:
+    """Shut down the PDF worker processes and the slide thread pool"""
+    global pdf_pool, pptx_pool
+    if pdf_pool is not None:
+        pdf_pool.shutdown(wait=False, cancel_futures=True)
+        pdf_pool = None
+    if pptx_pool is not None:
+        pptx_pool.shutdown(wait=False, cancel_futures=True)
+        pptx_pool = None
+
+def extract_pdf_text(path: str) -> str:
+    """Extract PDF text, fanning page ranges out to a process pool for long documents"""
+    pool = pdf_pool
+    with fitz.open(path) as doc:
+        page_count = doc.page_count
+        if pool is None or page_count < PDF_PARALLEL_MIN_PAGES:
+            return " ".join([page.get_text() for page in doc])
+
+    # One contiguous range per worker; each worker opens the file itself
+    step = -(-page_count // PDF_WORKERS)
+    jobs = [(path, start, min(start + step, page_count)) for start in range(0, page_count, step)]
+    return " ".join(pool.map(extract_pdf_pages, jobs))
+
+def start_unoserver() -> None:
+    """Launch the persistent LibreOffice conversion daemon if unoserver is installed"""
+    global unoserver_process
+    if UnoClient is None or shutil.which("unoserver") is None:
+        logger.info("unoserver not installed; .ppt files will use the LibreOffice CLI")
+        return
+    unoserver_process = subprocess.Popen(
+        ["unoserver", "--interface", UNOSERVER_HOST, "--port", str(UNOSERVER_PORT)],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+
+async def wait_for_unoserver() -> None:
+    """Mark the daemon ready once its RPC socket accepts connections"""
+    global unoserver_ready
+    for _ in range(UNOSERVER_STARTUP_SECONDS):
+        if unoserver_process is None or unoserver_process.poll() is not None:
+            break
+        try:
+            _, writer = await asyncio.open_connection(UNOSERVER_HOST, UNOSERVER_PORT)
+            writer.close()
+            unoserver_ready = True
+            logger.info("unoserver is ready for .ppt conversion")
+            return
+        except OSError:
+            await asyncio.sleep(1)
+    logger.warning("unoserver did not start; .ppt files will use the LibreOffice CLI")
+
+def stop_unoserver() -> None:
+    """Terminate the conversion daemon"""
+    global unoserver_ready
+    unoserver_ready = False
+    if unoserver_process is not None and unoserver_process.poll() is None:
+        unoserver_process.terminate()
+
+def convert_ppt_to_pptx(path: str) -> bytes:
+    """Convert a legacy .ppt deck to .pptx bytes, preferring the persistent unoserver daemon"""
+    if unoserver_ready and unoserver_process.poll() is None:
+        try:
+            with unoserver_lock:
+                converter = UnoClient(server=UNOSERVER_HOST, port=str(UNOSERVER_PORT))
+                return converter.convert(inpath=path, convert_to="pptx")
+        except Exception as e:
+            logger.warning(f"unoserver conversion failed, using LibreOffice CLI: {str(e)}")
+
+    # Fallback: one-off LibreOffice process. A private profile keeps it from
+    # clashing with the daemon's instance.
+    with tempfile.TemporaryDirectory() as tmpdir:
+        subprocess.run(
+            [
+                "libreoffice", f"-env:UserInstallation=file://{tmpdir}/profile",
+                "--headless", "--convert-to", "pptx", "--outdir", tmpdir, path
+            ],
+            check=True,
+            capture_output=True,
+            timeout=LIBREOFFICE_TIMEOUT
+        )
+        stem = os.path.splitext(os.path.basename(path))[0]
+        with open(os.path.join(tmpdir, f"{stem}.pptx"), "rb") as f:
+            return f.read()
+
+def slide_text(slide) -> str:
+    """Join the text of every text-bearing shape on a slide"""
+    return " ".join([shape.text for shape in slide.shapes if hasattr(shape, "text")])
+
+def extract_pptx_text(source) -> str:
+    """Extract slide text from a path or file object, spreading large decks across the thread pool"""
+    pool = pptx_pool
+    slides = list(Presentation(source).slides)
+    if pool is None or len(slides) < PPTX_PARALLEL_MIN_SLIDES:
+        return " ".join([slide_text(slide) for slide in slides])
+    return " ".join(pool.map(slide_text, slides))
+
+def extract_text(source: Union[str, IO[bytes]], extension: str) -> str:
+    """Extract text from supported file formats with error handling"""
+    try:
+        logger.info(f"Processing {extension.upper()} file")
+        
+        if extension == "pdf":
+            return extract_pdf_text(source)
+        
+        elif extension == "pptx":
+            return extract_pptx_text(source)
+
+        elif extension == "ppt":
+            # python-pptx only reads the OOXML format
+            return extract_pptx_text(io.BytesIO(convert_ppt_to_pptx(source)))
+        
+        elif extension == "docx":
+            doc = Document(source)
+            return " ".join([para.text for para in doc.paragraphs])
+        
+        raise ValueError(f"Unsupported file type: {extension}")
+    
+    except Exception as e:
+        logger.error(f"Text extraction failed: {str(e)}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Failed to process {extension.upper()} file: {str(e)}"
+        )
@@ -0,0 +1,68 @@
+# services/llm.py
+from fastapi import HTTPException
+import openai
+import httpx
+import orjson
+import os
+import asyncio
+from typing import Dict, Optional
+
+# One pooled async OpenAI client shared by every request, created on first use so
+# the endpoints that never call OpenAI work without an API key
+client: Optional[openai.AsyncOpenAI] = None
+
+def get_client() -> openai.AsyncOpenAI:
+    """Return the shared OpenAI client, creating it on first use"""
+    global client
+    if client is None:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not api_key:
+            raise HTTPException(
+                status_code=401,
+                detail="Invalid OpenAI API key. Check your configuration."
+            )
+        client = openai.AsyncOpenAI(
+            api_key=api_key,
+            http_client=httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=64, max_keepalive_connections=32)
+            )
+        )
+    return client
+
+async def close_client() -> None:
+    """Close the OpenAI client's connection pool"""
+    global client
+    if client is not None:
+        await client.close()
+        client = None
+
+class InFlightDeduper:
+    """Share one chat completion among concurrent requests with identical parameters
+
+    Requests are keyed by their exact parameters. The first request for a key is sent
+    immediately; identical requests arriving while it is in flight await the same
+    response instead of paying for their own call.
+    """
+
+    def __init__(self):
+        self.in_flight: Dict[bytes, asyncio.Future] = {}
+
+    async def submit(self, params: Dict):
+        """Return the chat completion for params, joining an identical in-flight call"""
+        key = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+        future = self.in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(get_client().chat.completions.create(**params))
+            self.in_flight[key] = future
+            future.add_done_callback(lambda done: self.finish(key, done))
+        # Shield so one caller disconnecting does not cancel the call for the others
+        return await asyncio.shield(future)
+
+    def finish(self, key: bytes, future: asyncio.Future) -> None:
+        """Forget a finished call and mark its exception retrieved, so a failure no
+        waiter is left to await is not logged as never retrieved"""
+        self.in_flight.pop(key, None)
+        if not future.cancelled():
+            future.exception()
+
+chat_dedup = InFlightDeduper()
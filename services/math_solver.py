@@ -0,0 +1,32 @@
+# services/math_solver.py
+import functools
+import sympy as sp
+from sympy.parsing.sympy_parser import parse_expr
+from typing import Dict, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+@functools.lru_cache(maxsize=4096)
+def solve_normalized(problem: str) -> Tuple[str, str]:
+    """Parse and solve a normalized problem; repeated problems are served from the cache"""
+    solution = sp.solve(parse_expr(problem))
+    return str(solution), sp.pretty(solution)
+
+def solve_math_problem(problem: str) -> Dict:
+    """Solve mathematical equations with SymPy"""
+    try:
+        # Handle different equation formats
+        problem = problem.replace("^", "**").strip()
+        solution, steps = solve_normalized(problem)
+        return {
+            "problem": problem,
+            "solution": solution,
+            "steps": steps
+        }
+    except Exception as e:
+        logger.error(f"Math solving failed: {str(e)}")
+        return {
+            "error": f"Could not solve {problem}",
+            "details": str(e)
+        }
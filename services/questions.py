@@ -0,0 +1,360 @@
+# services/questions.py
+from fastapi import HTTPException
+import openai
+import orjson
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import logging
+
+from services.llm import chat_dedup, get_client
+
+logger = logging.getLogger(__name__)
+
+# Prompt sizing
+PROMPT_CHAR_LIMIT = 3000
+GENERATION_WINDOWS = 3  # long texts are split into up to this many prompts run concurrently
+GENERATION_CHAR_LIMIT = PROMPT_CHAR_LIMIT * GENERATION_WINDOWS
+QUESTION_COUNTS = {"multiple_choice": 30, "fill_in": 15, "short_answer": 5}
+# A question type returning fewer than this share of its requested count failed
+MIN_CATEGORY_SHARE = 0.8
+
+# Texts longer than one prompt window are summarized (map) before generation (reduce)
+SUMMARY_WINDOW_CHARS = 16000  # roughly 4000 tokens per summarization call
+SUMMARY_MAX_WINDOWS = 6
+GENERATION_SOURCE_CHARS = SUMMARY_WINDOW_CHARS * SUMMARY_MAX_WINDOWS  # input span generation reads
+# Every summary must fit, so the joined summaries never exceed the generation windows
+SUMMARY_MAX_CHARS = GENERATION_CHAR_LIMIT // SUMMARY_MAX_WINDOWS - 2  # minus the "\n\n" separator
+SUMMARY_MAX_TOKENS = 300  # roughly 1200 characters
+SUMMARY_CACHE_SIZE = 1024
+summary_cache: "OrderedDict[str, str]" = OrderedDict()  # sha256(window) -> summary
+
+# Each question type is generated by its own concurrent call, so no single
+# response has to decode the whole question set
+CATEGORY_PROMPTS = {
+    "multiple_choice": """Generate {count} multiple choice exam questions from this text.
+    Respond with JSON in exactly this format:
+    {{"multiple_choice": [{{"question": "...", "options": ["A","B","C","D"], "answer": "A"}}]}}
+    Text content: {text}""",
+    "fill_in": """Generate {count} fill-in-the-blank exam questions from this text.
+    Respond with JSON in exactly this format:
+    {{"fill_in": [{{"question": "...", "answer": "..."}}]}}
+    Text content: {text}""",
+    "short_answer": """Generate {count} short answer exam questions from this text.
+    Respond with JSON in exactly this format:
+    {{"short_answer": [{{"question": "...", "answer": "..."}}]}}
+    Text content: {text}"""
+}
+# Output budget per question; generous enough that JSON is never cut off mid-object
+MAX_TOKENS_PER_QUESTION = {"multiple_choice": 150, "fill_in": 80, "short_answer": 150}
+MAX_COMPLETION_TOKENS = 4096  # gpt-3.5-turbo rejects larger max_tokens
+RESPONSE_OVERHEAD_TOKENS = 100
+
+def build_question_request(text: str, counts: Dict[str, int] = QUESTION_COUNTS) -> Dict:
+    """Build the chat completion parameters for question generation"""
+    prompt = f"""Generate {sum(counts.values())} comprehensive exam questions from this text.
+    Include {counts["multiple_choice"]} multiple choice, {counts["fill_in"]} fill-in-the-blank,
+    and {counts["short_answer"]} short answer questions.
+    Use this exact JSON format:
+    {{
+        "multiple_choice": [
+            {{"question": "...", "options": ["A","B","C","D"], "answer": "A"}}
+        ],
+        "fill_in": [
+            {{"question": "...", "answer": "..."}}
+        ],
+        "short_answer": [
+            {{"question": "...", "answer": "..."}}
+        ]
+    }}
+    Text content: {text[:PROMPT_CHAR_LIMIT]}"""  # Limit text length for OpenAI
+
+    return {
+        "model": "gpt-3.5-turbo",
+        "messages": [{
+            "role": "user",
+            "content": prompt
+        }],
+        "temperature": 0.3  # More deterministic output
+    }
+
+def build_category_request(text: str, q_type: str, count: int) -> Dict:
+    """Build the chat completion parameters for one question type"""
+    return {
+        "model": "gpt-3.5-turbo",
+        "messages": [{
+            "role": "user",
+            "content": CATEGORY_PROMPTS[q_type].format(count=count, text=text[:PROMPT_CHAR_LIMIT])
+        }],
+        "temperature": 0.3,
+        "max_tokens": min(
+            count * MAX_TOKENS_PER_QUESTION[q_type] + RESPONSE_OVERHEAD_TOKENS,
+            MAX_COMPLETION_TOKENS
+        ),
+        "response_format": {"type": "json_object"}  # Guarantees a parseable JSON skeleton
+    }
+
+def build_question_stream_request(text: str, counts: Dict[str, int]) -> Dict:
+    """Build streaming chat completion parameters that yield one question per line"""
+    prompt = f"""Generate {sum(counts.values())} comprehensive exam questions from this text.
+    Include {counts["multiple_choice"]} multiple choice, {counts["fill_in"]} fill-in-the-blank,
+    and {counts["short_answer"]} short answer questions.
+    Output one JSON object per line and nothing else, using these exact formats:
+    {{"type": "multiple_choice", "question": "...", "options": ["A","B","C","D"], "answer": "A"}}
+    {{"type": "fill_in", "question": "...", "answer": "..."}}
+    {{"type": "short_answer", "question": "...", "answer": "..."}}
+    Text content: {text[:PROMPT_CHAR_LIMIT]}"""
+
+    return {
+        "model": "gpt-3.5-turbo",
+        "messages": [{
+            "role": "user",
+            "content": prompt
+        }],
+        "temperature": 0.3,
+        "stream": True
+    }
+
+def clean_question(question) -> Optional[Dict]:
+    """Coerce one generated question to string fields, or None if it has no question or answer"""
+    if not isinstance(question, dict) or question.get("question") is None or question.get("answer") is None:
+        return None
+    cleaned = {**question, "question": str(question["question"]), "answer": str(question["answer"])}
+    if "options" in question:
+        options = question["options"]
+        cleaned["options"] = [str(option) for option in options] if isinstance(options, list) else []
+    return cleaned
+
+def parse_questions(content: str) -> Dict:
+    """Validate and parse the question JSON returned by OpenAI"""
+    try:
+        data = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        data = None
+    if not isinstance(data, dict):
+        logger.error("Invalid JSON from OpenAI: %s", content)
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to parse question format. Please try again."
+        )
+
+    questions = {}
+    for q_type in QUESTION_COUNTS:
+        items = data.get(q_type)
+        if not isinstance(items, list):
+            continue
+        cleaned = [question for question in map(clean_question, items) if question is not None]
+        if len(cleaned) < len(items):
+            logger.warning("Dropped %d malformed %s questions from OpenAI", len(items) - len(cleaned), q_type)
+        questions[q_type] = cleaned
+    return questions
+
+def questions_complete(questions: Dict, counts: Dict[str, int] = QUESTION_COUNTS) -> bool:
+    """Whether every requested question type came back with most of its questions"""
+    return all(
+        len(questions.get(q_type, [])) >= MIN_CATEGORY_SHARE * count
+        for q_type, count in counts.items()
+    )
+
+def require_complete(questions: Dict, counts: Dict[str, int] = QUESTION_COUNTS) -> Dict:
+    """Return questions, failing the generation when a type is missing or well short"""
+    if not questions_complete(questions, counts):
+        logger.error(
+            "Incomplete question set from OpenAI: %s",
+            {q_type: len(questions.get(q_type, [])) for q_type in counts}
+        )
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to generate a complete question set. Please try again."
+        )
+    return questions
+
+def split_counts(parts: int) -> List[Dict[str, int]]:
+    """Divide the requested question counts as evenly as possible across parts"""
+    return [
+        {q_type: count // parts + (i < count % parts) for q_type, count in QUESTION_COUNTS.items()}
+        for i in range(parts)
+    ]
+
+def split_windows(text: str) -> List[str]:
+    """Split long texts into the prompt windows that are generated in parallel"""
+    return [
+        text[i:i + PROMPT_CHAR_LIMIT]
+        for i in range(0, min(len(text), GENERATION_CHAR_LIMIT), PROMPT_CHAR_LIMIT)
+    ] or [text]
+
+def split_category_count(q_type: str, count: int) -> List[int]:
+    """Divide one question type's count into calls whose full budget fits the completion limit"""
+    per_call = (MAX_COMPLETION_TOKENS - RESPONSE_OVERHEAD_TOKENS) // MAX_TOKENS_PER_QUESTION[q_type]
+    calls = -(-count // per_call)
+    return [count // calls + (i < count % calls) for i in range(calls)]
+
+async def request_category(text: str, q_type: str, count: int) -> List[Dict]:
+    """Generate the questions of a single type"""
+    response = await chat_dedup.submit(build_category_request(text, q_type, count))
+    questions = parse_questions(response.choices[0].message.content)
+    return require_complete(questions, {q_type: count})[q_type]
+
+async def request_questions(text: str, counts: Dict[str, int]) -> Dict:
+    """Generate each question type for a window in its own concurrent call(s)"""
+    jobs = []
+    for q_type, count in counts.items():
+        if count == 0:
+            continue
+        # A type split across calls gives each call its own slice of the window, so
+        # the calls ask about different material (and are not deduplicated into one)
+        parts = split_category_count(q_type, count)
+        jobs += [
+            (q_type, text[i * len(text) // len(parts):(i + 1) * len(text) // len(parts)], part)
+            for i, part in enumerate(parts)
+        ]
+    results = await asyncio.gather(*(
+        request_category(part_text, q_type, part) for q_type, part_text, part in jobs
+    ))
+    questions: Dict[str, List[Dict]] = {}
+    for (q_type, _, _), result in zip(jobs, results):
+        questions.setdefault(q_type, []).extend(result)
+    return questions
+
+async def summarize(text: str) -> str:
+    """Summarize one window of text, reusing the cached summary for identical windows"""
+    key = hashlib.sha256(text.encode()).hexdigest()
+    if key in summary_cache:
+        summary_cache.move_to_end(key)
+        return summary_cache[key]
+
+    response = await chat_dedup.submit({
+        "model": "gpt-3.5-turbo",
+        "max_tokens": SUMMARY_MAX_TOKENS,
+        "temperature": 0,
+        "messages": [
+            {
+                "role": "system",
+                "content": "Write a precise summary of about 150 words. Keep the facts, "
+                           "definitions, formulas and figures a teacher would examine."
+            },
+            {"role": "user", "content": text}
+        ]
+    })
+    summary = response.choices[0].message.content[:SUMMARY_MAX_CHARS]
+    summary_cache[key] = summary
+    if len(summary_cache) > SUMMARY_CACHE_SIZE:
+        summary_cache.popitem(last=False)
+    return summary
+
+async def condense_text(text: str) -> str:
+    """Map long texts to concatenated window summaries so generation sees fewer tokens"""
+    if len(text) <= PROMPT_CHAR_LIMIT:
+        return text
+    windows = [
+        text[i:i + SUMMARY_WINDOW_CHARS]
+        for i in range(0, min(len(text), GENERATION_SOURCE_CHARS), SUMMARY_WINDOW_CHARS)
+    ]
+    summaries = await asyncio.gather(*(summarize(window) for window in windows))
+    return "\n\n".join(summaries)
+
+async def generate_exam_questions(text: str) -> Dict:
+    """Generate 50 questions using OpenAI with validation"""
+    try:
+        # Long texts are summarized, then split into windows generated in parallel
+        windows = split_windows(await condense_text(text))
+        parts = await asyncio.gather(*(
+            request_questions(window, counts)
+            for window, counts in zip(windows, split_counts(len(windows)))
+        ))
+        return {
+            q_type: [q for part in parts for q in part.get(q_type, [])]
+            for q_type in QUESTION_COUNTS
+        }
+    
+    except HTTPException:
+        raise
+    except openai.AuthenticationError:
+        raise HTTPException(
+            status_code=401,
+            detail="Invalid OpenAI API key. Check your configuration."
+        )
+    except Exception as e:
+        logger.error(f"OpenAI API Error: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Question generation failed: {str(e)}"
+        )
+
+def parse_question_line(line: str) -> Optional[Dict]:
+    """Parse one streamed question line, skipping blank or malformed output"""
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        question = orjson.loads(line)
+    except orjson.JSONDecodeError:
+        logger.warning("Skipping invalid question line from OpenAI: %s", line)
+        return None
+    if not isinstance(question, dict) or question.get("type") not in QUESTION_COUNTS:
+        logger.warning("Skipping unexpected question line from OpenAI: %s", line)
+        return None
+    cleaned = clean_question(question)
+    if cleaned is None:
+        logger.warning("Skipping incomplete question line from OpenAI: %s", line)
+    return cleaned
+
+async def stream_window_questions(text: str, counts: Dict[str, int]) -> AsyncIterator[Dict]:
+    """Yield questions from one streamed generation call as each line completes"""
+    stream = await get_client().chat.completions.create(**build_question_stream_request(text, counts))
+    buffer = ""
+    async for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if not delta or "\n" not in delta:
+            buffer += delta or ""
+            continue
+        # Parse each line as soon as it completes; the tail waits for more tokens
+        *lines, buffer = (buffer + delta).split("\n")
+        for line in lines:
+            question = parse_question_line(line)
+            if question is not None:
+                yield question
+    question = parse_question_line(buffer)
+    if question is not None:
+        yield question
+
+async def stream_exam_questions(text: str) -> AsyncIterator[Dict]:
+    """Yield questions as they arrive from all prompt windows streamed concurrently"""
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def produce(window: str, counts: Dict[str, int]) -> None:
+        try:
+            async for question in stream_window_questions(window, counts):
+                await queue.put(question)
+        finally:
+            await queue.put(None)  # Marks this window as finished
+
+    windows = split_windows(await condense_text(text))
+    tasks = [
+        asyncio.create_task(produce(window, counts))
+        for window, counts in zip(windows, split_counts(len(windows)))
+    ]
+    try:
+        finished = 0
+        while finished < len(tasks):
+            question = await queue.get()
+            if question is None:
+                finished += 1
+            else:
+                yield question
+        for task in tasks:
+            task.result()  # Surface any window failure
+    finally:
+        for task in tasks:
+            task.cancel()
+
+def flatten_questions(questions: Dict) -> List[Tuple[str, str]]:
+    """Flatten questions into (question, normalized answer) pairs once, at storage time"""
+    return [
+        (question["question"], question["answer"].strip().lower())
+        for q_type in QUESTION_COUNTS
+        for question in questions.get(q_type, [])
+    ]
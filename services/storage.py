@@ -0,0 +1,66 @@
+# services/storage.py
+import orjson
+import redis.asyncio as aioredis
+import os
+from typing import Dict, List
+
+# Question bank and student answers live in Redis so every worker sees every upload
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+STORAGE_TTL_SECONDS = 86400
+# Entries awaiting a Batch API result must outlive its 24h completion window
+AWAITING_BATCH_TTL_SECONDS = 3 * 86400
+redis_client = aioredis.from_url(REDIS_URL)
+
+async def load_questions(filename: str) -> Dict:
+    """Fetch the stored question bank entry for a file, or {} if there is none"""
+    data = await redis_client.get(f"qb:{filename}")
+    return orjson.loads(data) if data else {}
+
+async def save_questions(filename: str, entry: Dict) -> None:
+    """Store the question bank entry for a file"""
+    awaiting_batch = "batch_id" in entry and "questions" not in entry and "error" not in entry
+    ttl = AWAITING_BATCH_TTL_SECONDS if awaiting_batch else STORAGE_TTL_SECONDS
+    await redis_client.set(f"qb:{filename}", orjson.dumps(entry), ex=ttl)
+
+async def load_answers(filename: str) -> Dict:
+    """Fetch the submitted answers for a file, or {} if there are none"""
+    data = await redis_client.get(f"sa:{filename}")
+    return orjson.loads(data) if data else {}
+
+async def save_answers(filename: str, answers: Dict) -> None:
+    """Store the submitted answers for a file"""
+    await redis_client.set(f"sa:{filename}", orjson.dumps(answers), ex=STORAGE_TTL_SECONDS)
+
+async def save_pending_request(filename: str, line: Dict) -> None:
+    """Queue a Batch API request line; a re-upload replaces the earlier pending one"""
+    await redis_client.hset("batch:pending", filename, orjson.dumps(line))
+
+async def take_pending_requests() -> Dict[str, Dict]:
+    """Atomically remove and return every queued Batch API request line"""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pending, _ = await pipe.hgetall("batch:pending").delete("batch:pending").execute()
+    return {filename.decode(): orjson.loads(line) for filename, line in pending.items()}
+
+async def restore_pending_requests(lines: Dict[str, Dict]) -> None:
+    """Requeue request lines, keeping any newer line queued for the same file meanwhile"""
+    async with redis_client.pipeline(transaction=True) as pipe:
+        for filename, line in lines.items():
+            pipe.hsetnx("batch:pending", filename, orjson.dumps(line))
+        await pipe.execute()
+
+async def has_pending_request(filename: str) -> bool:
+    """Whether a request line for the file is waiting to be submitted"""
+    return bool(await redis_client.hexists("batch:pending", filename))
+
+async def save_batch_files(batch_id: str, filenames: List[str]) -> None:
+    """Record which files a submitted batch contains"""
+    await redis_client.sadd(f"batch:files:{batch_id}", *filenames)
+    await redis_client.expire(f"batch:files:{batch_id}", AWAITING_BATCH_TTL_SECONDS)
+
+async def load_batch_files(batch_id: str) -> List[str]:
+    """Fetch the files a submitted batch contains"""
+    return [filename.decode() for filename in await redis_client.smembers(f"batch:files:{batch_id}")]
+
+async def close_storage() -> None:
+    """Close the Redis connection pool"""
+    await redis_client.aclose()
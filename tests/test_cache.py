@@ -0,0 +1,56 @@
+import asyncio
+
+import numpy as np
+
+from services import cache
+from services.questions import QUESTION_COUNTS
+
+def question_set(label: str, share: float = 1.0):
+    """A question set with share of every requested count"""
+    return {
+        q_type: [{"question": f"{label} {q_type} {i}", "answer": "a"} for i in range(int(count * share))]
+        for q_type, count in QUESTION_COUNTS.items()
+    }
+
+def fresh_caches(monkeypatch) -> None:
+    monkeypatch.setattr(cache, "question_cache", cache.SemanticCache(cache.CACHE_SIMILARITY_THRESHOLD, 8))
+    monkeypatch.setattr(cache, "chunk_cache", cache.SemanticCache(cache.CHUNK_SIMILARITY_THRESHOLD, 8))
+
+def test_partial_question_sets_are_not_cached(monkeypatch):
+    fresh_caches(monkeypatch)
+    embeddings = np.eye(3, dtype=np.float32)
+    cache.cache_store(embeddings, question_set("partial", share=0.1))
+    assert cache.question_cache.lookup(embeddings[0]) is None
+    cache.cache_store(embeddings, question_set("full"))
+    assert cache.question_cache.lookup(embeddings[0]) is not None
+
+DIMENSIONS = 8
+
+def deck(*chunk_ids: int) -> str:
+    """Text whose chunks embed to the given basis vectors"""
+    return " ".join(" ".join([f"c{i}"] * cache.CHUNK_WORDS) for i in chunk_ids)
+
+async def fake_embed_texts(texts):
+    return np.eye(DIMENSIONS, dtype=np.float32)[[int(text.split()[0][1:]) for text in texts]]
+
+def store(text: str, questions) -> None:
+    _, embeddings = asyncio.run(cache.cache_lookup(text))
+    cache.cache_store(embeddings, questions)
+
+def test_subset_deck_does_not_compose_from_larger_deck(monkeypatch):
+    fresh_caches(monkeypatch)
+    monkeypatch.setattr(cache, "embed_texts", fake_embed_texts)
+    store(deck(0, 1, 2, 3), question_set("chapters 0-3"))
+    questions, embeddings = asyncio.run(cache.cache_lookup(deck(0, 1)))
+    assert questions is None
+    assert embeddings is not None
+
+def test_deck_covering_whole_cached_decks_composes(monkeypatch):
+    fresh_caches(monkeypatch)
+    monkeypatch.setattr(cache, "embed_texts", fake_embed_texts)
+    store(deck(0, 1), question_set("chapters 0-1"))
+    store(deck(2, 3), question_set("chapters 2-3"))
+    questions, _ = asyncio.run(cache.cache_lookup(deck(0, 1, 2, 3)))
+    assert questions is not None
+    assert {q["question"].split(" ")[1] for q in questions["multiple_choice"]} == {"0-1", "2-3"}
+    assert len(questions["multiple_choice"]) == QUESTION_COUNTS["multiple_choice"]
@@ -0,0 +1,68 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+from services import questions as questions_module
+from services.questions import (
+    MAX_COMPLETION_TOKENS, QUESTION_COUNTS, build_category_request, flatten_questions,
+    parse_question_line, parse_questions, questions_complete, request_category,
+    split_category_count, split_counts
+)
+
+def completion(content: str):
+    """Shape a chat completion response around content"""
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+def reply_with(monkeypatch, content: str) -> None:
+    async def submit(params):
+        return completion(content)
+    monkeypatch.setattr(questions_module.chat_dedup, "submit", submit)
+
+def test_single_window_keeps_full_counts():
+    assert split_counts(1) == [QUESTION_COUNTS]
+
+def test_category_requests_fit_completion_limit():
+    for q_type, count in split_counts(1)[0].items():
+        for part in split_category_count(q_type, count):
+            request = build_category_request("text", q_type, part)
+            assert request["max_tokens"] <= MAX_COMPLETION_TOKENS
+
+def test_large_multiple_choice_count_is_split():
+    parts = split_category_count("multiple_choice", QUESTION_COUNTS["multiple_choice"])
+    assert len(parts) > 1
+    assert sum(parts) == QUESTION_COUNTS["multiple_choice"]
+
+def test_category_request_budget_is_capped():
+    request = build_category_request("text", "multiple_choice", 100)
+    assert request["max_tokens"] == MAX_COMPLETION_TOKENS
+
+def test_parse_questions_coerces_and_drops_malformed_items():
+    questions = parse_questions(
+        '{"fill_in": [{"question": "2 + 2 = _", "answer": 4}, {"question": "No answer"}, "junk"]}'
+    )
+    assert questions == {"fill_in": [{"question": "2 + 2 = _", "answer": "4"}]}
+    assert flatten_questions(questions) == [("2 + 2 = _", "4")]
+
+def test_parse_question_line_skips_missing_answer():
+    assert parse_question_line('{"type": "short_answer", "question": "Why?"}') is None
+
+def test_missing_category_fails_generation(monkeypatch):
+    reply_with(monkeypatch, '{"questions": []}')
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(request_category("text", "fill_in", 15))
+    assert error.value.status_code == 500
+
+def test_short_category_fails_generation(monkeypatch):
+    reply_with(monkeypatch, '{"fill_in": [{"question": "q", "answer": "a"}]}')
+    with pytest.raises(HTTPException):
+        asyncio.run(request_category("text", "fill_in", 15))
+
+def test_questions_complete_requires_every_type():
+    full = {
+        q_type: [{"question": f"{q_type} {i}", "answer": "a"} for i in range(count)]
+        for q_type, count in QUESTION_COUNTS.items()
+    }
+    assert questions_complete(full)
+    assert not questions_complete({**full, "short_answer": []})